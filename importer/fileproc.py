@@ -1,24 +1,63 @@
 """Process files as requested."""
 
 
+import errno
 import fnmatch
 import logging
 import os
+import re
 import shutil
-import warnings
+import stat
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import AnyStr, Callable, Iterable, List, Optional
-from zipfile import ZIP_DEFLATED, ZipFile
+from typing import Callable, Deque, Iterator, List, Optional, Tuple, Union
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
 
 logger = logging.getLogger("importer.fileproc")
 
+# Buffer size for copies performed in Python.
+COPY_BUFSIZE = 1024 * 1024
+
+# Whether file data can be copied in kernel space with copy_file_range(2) or
+# sendfile(2). COPY_RANGE is cleared if the kernel turns out not to support it.
+COPY_RANGE = hasattr(os, "copy_file_range")
+SENDFILE = sys.platform.startswith("linux") and hasattr(os, "sendfile")
+
+# Suffixes of formats that are already compressed, and are therefore stored
+# as they are in archives, without wasting time deflating them again.
+STORED_SUFFIXES = {
+    ".7z", ".bz2", ".gz", ".xz", ".zip", ".zst",
+    ".gif", ".jpeg", ".jpg", ".png", ".webp",
+    ".avi", ".mkv", ".mov", ".mp3", ".mp4",
+}
+
+# Minimum time, in seconds, between two progress notifications.
+PROGRESS_INTERVAL = 1 / 60
+
+# Files up to this size are read ahead by worker threads while archiving;
+# larger ones are streamed into the archive by the writing thread.
+PREFETCH_MAXSIZE = 16 * 1024 * 1024
+
+# Errors a plain copy would hit as well: a kernel-side copy that fails with
+# any other error, before writing anything, falls back to a plain one (e.g.
+# when a seccomp filter denies the syscall with EPERM).
+KERNEL_COPY_FATAL = {
+    errno.ENOSPC,
+    errno.EIO,
+}
+
 
 def transplant_path(src: Path, src_root: Path, dst_root: Optional[Path]) -> Path:
     """
     Transplant the root of an absolute path.
 
     Get the root that src, under src_root, would have had if it were, instead,
-    under dst_root.
+    under dst_root. All the paths are expected to be already resolved, so that
+    no filesystem access is needed.
 
     :param src: The source path.
     :param src_root: The root under which the path should be cut.
@@ -26,11 +65,219 @@ def transplant_path(src: Path, src_root: Path, dst_root: Optional[Path]) -> Path
         no insertion will be performed.
     :return: The transplanted path.
     """
-    relp = src.relative_to(src_root.resolve())
+    relp = src.relative_to(src_root)
     if dst_root is None:
         return relp
     else:
-        return dst_root.resolve().joinpath(relp)
+        return dst_root.joinpath(relp)
+
+
+def transplant_str(src: str, src_root_len: int, dst_root: str) -> str:
+    """Transplant the root of a path, as transplant_path, on strings only.
+
+    :param src: The source path, starting with the source root.
+    :param src_root_len: The length of the source root, including the trailing
+        separator.
+    :param dst_root: The root under which the path should be inserted.
+    :return: The transplanted path.
+    """
+    return os.path.join(dst_root, src[src_root_len:])
+
+
+def kernel_copy(infd: int, outfd: int) -> bool:
+    """Copy all the data between two file descriptors in kernel space.
+
+    copy_file_range(2) is tried first, as it can clone the file on
+    copy-on-write filesystems and copy server-side on NFS; sendfile(2) is the
+    second choice.
+
+    :param infd: The file descriptor to read from.
+    :param outfd: The file descriptor to write to.
+    :return: True if the data was copied, False if it could not be copied in
+        kernel space (in which case nothing was written).
+    :raises OSError: On errors in KERNEL_COPY_FATAL, or after a partial copy.
+    """
+    global COPY_RANGE
+    size = os.fstat(infd).st_size
+    count = min(max(size, 2 ** 23), 2 ** 30)
+    copied = 0
+
+    if COPY_RANGE:
+        try:
+            while (n := os.copy_file_range(infd, outfd, count)) > 0:
+                copied += n
+            # Some filesystems report no data instead of failing.
+            if copied > 0 or size == 0:
+                return True
+        except OSError as e:
+            if copied > 0 or e.errno in KERNEL_COPY_FATAL:
+                raise
+            if e.errno == errno.ENOSYS:
+                COPY_RANGE = False
+
+    if SENDFILE:
+        try:
+            while (n := os.sendfile(outfd, infd, None, count)) > 0:
+                copied += n
+            return True
+        except OSError as e:
+            if copied > 0 or e.errno in KERNEL_COPY_FATAL:
+                raise
+
+    return False
+
+
+def copy_file(src: Union[str, os.DirEntry], dst: str):
+    """Copy a file together with its metadata, as shutil.copy2.
+
+    The data is copied in kernel space when possible (see kernel_copy). On
+    macOS, shutil.copy2 is used, as it already relies on fcopyfile(3).
+    Otherwise, the copy is done with a buffer of COPY_BUFSIZE bytes, instead of
+    the smaller default one.
+
+    :param src: The source file.
+    :param dst: The destination file.
+    :raises shutil.SpecialFileError: If the source is not a regular file, e.g.
+        a named pipe, which could block the copy forever.
+    """
+    if sys.platform == "darwin":
+        shutil.copy2(src, dst)
+        return
+
+    st = src.stat() if isinstance(src, os.DirEntry) else os.stat(src)
+    if not stat.S_ISREG(st.st_mode):
+        raise shutil.SpecialFileError(f"`{os.fspath(src)}` is not a regular file")
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        if not kernel_copy(fsrc.fileno(), fdst.fileno()):
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+    shutil.copystat(src, dst)
+
+
+def read_file(path: str) -> bytes:
+    """Read the whole content of a file.
+
+    :param path: The path of the file.
+    :return: The content of the file.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def zipinfo_from_entry(entry: os.DirEntry, arcname: str) -> ZipInfo:
+    """Build the ZipInfo of a file, as ZipInfo.from_file, from its DirEntry.
+
+    The stat result is cached on the entry: on POSIX, the first call to
+    DirEntry.stat issues a single stat, and later calls need no syscall.
+
+    :param entry: The directory entry of the file.
+    :param arcname: The name of the file in the archive.
+    :return: The ZipInfo instance of the archive member.
+    """
+    st = entry.stat()
+    zinfo = ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.file_size = st.st_size
+    return zinfo
+
+
+def compile_patterns(patterns: List[str]) -> Optional[re.Pattern]:
+    """Compile a list of glob patterns into a single regular expression.
+
+    :param patterns: The glob patterns, with fnmatch syntax.
+    :return: A compiled regex matching any of the patterns, or None if there
+        are no patterns.
+    """
+    if len(patterns) == 0:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+def scan_tree(
+        root: str,
+        ignore: Optional[re.Pattern] = None,
+        followlinks: bool = False
+) -> Iterator[Tuple[str, List[os.DirEntry], List[os.DirEntry]]]:
+    """Walk a directory tree top-down, using os.scandir.
+
+    Behaves like os.walk, but yields the DirEntry objects, so that their cached
+    type and stat information can be reused. As with os.walk, the caller can
+    prune the traversal by modifying the directory list in place. Directories
+    that cannot be listed (e.g. for lack of permissions) are skipped.
+
+    :param root: The root of the tree.
+    :param ignore: Regex matching the names of the entries to skip. Those are
+        dropped before their type is even checked, and ignored directories are
+        never descended into.
+    :param followlinks: Whether to descend into symlinks to directories (which
+        are listed among the directories anyway), defaults to False.
+    :return: An iterator over tuples (dirpath, dir entries, file entries).
+    """
+    stack = [root]
+    while stack:
+        curr = stack.pop()
+        dirs = []
+        files = []
+        try:
+            with os.scandir(curr) as it:
+                if ignore is None:
+                    entries = it
+                else:
+                    entries = (e for e in it if not ignore.match(e.name))
+                for entry in entries:
+                    if entry.is_dir():
+                        dirs.append(entry)
+                    else:
+                        files.append(entry)
+        except OSError as e:
+            # as os.walk, skip the directories that cannot be listed
+            logger.warning(f"Skipping `{curr}`: {e}")
+            continue
+
+        yield curr, dirs, files
+
+        stack.extend(
+            d.path for d in reversed(dirs) if followlinks or not d.is_symlink()
+        )
+
+
+class ProgressBatcher:
+    """Coalesce the per-file progress notifications.
+
+    The wrapped callback is called at most once every PROGRESS_INTERVAL
+    seconds, with the number of files processed since its previous call, and
+    the description of the last one. Descriptions are only formatted when the
+    callback is actually called.
+
+    :param cb: Callback taking the number of processed files and a description.
+    :param action: The action performed on the files, e.g. "Copying".
+    """
+
+    def __init__(self, cb: Callable[[int, str], None], action: str):
+        """Initialize the batcher."""
+        self._cb = cb
+        self._action = action
+        self._count = 0
+        self._name = ""
+        self._last = time.monotonic()
+
+    def __call__(self, name: str):
+        """Record a processed file, notifying the callback if it is time.
+
+        :param name: The name of the processed file.
+        """
+        self._count += 1
+        self._name = name
+        now = time.monotonic()
+        if now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            self.flush()
+
+    def flush(self):
+        """Notify the callback of the files not yet reported."""
+        if self._count > 0:
+            self._cb(self._count, f"{self._action} {self._name}")
+            self._count = 0
 
 
 class FileProcessor:
@@ -42,6 +289,10 @@ class FileProcessor:
     :param compress: Whether to compress the copied files in an archive
     :param force: Whether the copy should overwrite pre-existing stuff
     :param ignore_patterns: Globs to ignore for the copy
+    :param workers: Number of threads copying files concurrently, defaults to 8
+    :param compresslevel: Deflate level for archives, defaults to 6
+    :param preserve_dir_stat: Whether copied directories should keep the
+        metadata (timestamps, permissions) of the source ones, defaults to True
     """
 
     def __init__(
@@ -51,7 +302,10 @@ class FileProcessor:
             repopath: Path,
             compress: bool,
             force: bool,
-            ignore_patterns: List[str]
+            ignore_patterns: List[str],
+            workers: int = 8,
+            compresslevel: int = 6,
+            preserve_dir_stat: bool = True
     ):
         """Initialize processor."""
         self._indir = indir.resolve()
@@ -59,30 +313,42 @@ class FileProcessor:
         self._repopath = repopath.resolve()
         self._compress = compress
         self._force = force
-        self._ignore_patterns = ignore_patterns
+        self._ignore_re = compile_patterns(ignore_patterns)
+        self._workers = max(1, workers)
+        self._compresslevel = compresslevel
+        self._preserve_dir_stat = preserve_dir_stat
 
-    def __call__(self, cb: Callable[[str], None]) -> int:
+    def __call__(
+            self,
+            cb: Callable[[int, str], None],
+            on_count: Optional[Callable[[int], None]] = None
+    ) -> int:
         """Process the files with the required methods.
 
-        :param cb: Callback, called once for each processed file.
+        :param cb: Progress callback, called with the number of files processed
+            since its previous call and a description of the last one.
+        :param on_count: Optional callback, called with the total number of
+            files to process as soon as the source tree has been walked, while
+            the processing may still be ongoing.
         :return: An error code. Follows errno conventions (as much as possible).
         """
         if not self._compress:
             logger.info("Files will be copied.")
-            return self.copy(cb)
+            return self.copy(cb, on_count)
         else:
             logger.info("Files will be archived.")
-            return self.archive(cb)
+            return self.archive(cb, on_count)
 
     def count_files(self) -> int:
         """Count the files that will be processed.
 
+        This needs a walk of the source tree: when processing, prefer the
+        on_count callback, which reports the count without an extra walk.
+
         :return: The number of processed files.
         """
         n = 0
-        for _, dns, fns in os.walk(self._indir):
-            dns[:] = self._remove_ignored(dns)
-            fns = self._remove_ignored(fns)
+        for _, _, fns in scan_tree(str(self._indir), self._ignore_re):
             n += len(fns)
 
         return n
@@ -122,10 +388,18 @@ class FileProcessor:
         """Overwrite if destination already exists (True) or not (False)."""
         return self._force
 
-    def copy(self, cb: Callable[[str], None]) -> int:
+    def copy(
+            self,
+            cb: Callable[[int, str], None],
+            on_count: Optional[Callable[[int], None]] = None
+    ) -> int:
         """Copy the files to destination.
 
-        :param cb: Callback, called once for each processed file.
+        :param cb: Progress callback, called with the number of files processed
+            since its previous call and a description of the last one.
+        :param on_count: Optional callback, called with the total number of
+            files to process as soon as the source tree has been walked, while
+            the processing may still be ongoing.
         :return: An error code. Follows errno conventions (as much as possible).
         """
         src_root = self.src
@@ -137,52 +411,100 @@ class FileProcessor:
             logger.error(f"Error while copying files: {e}")
             return 17  # EEXIST: File exists
 
-        for curr, dns, fns in os.walk(src_root):
-            curr = Path(curr).resolve()
-            dst = transplant_path(curr, src_root, dst_root)
-            logger.debug(f"{curr = }\n{dst = }")
+        src_root_len = len(os.path.join(str(src_root), ""))
+        dst_root_str = str(dst_root)
+        progress = ProgressBatcher(cb, "Copying")
+        cb_lock = threading.Lock()
+
+        def copy_task(src: os.DirEntry, dst: str, name: str):
+            copy_file(src, dst)
+            with cb_lock:
+                progress(name)
+
+        # Bind to locals what is looked up on every iteration.
+        debug = logger.isEnabledFor(logging.DEBUG)
+        ignore = self._ignore_re
+        preserve_dir_stat = self._preserve_dir_stat
+        dirs: List[Tuple[Path, Path]] = []
+
+        # Directories are created in order by this thread, while the files are
+        # copied concurrently by the pool.
+        futures: List[Future] = []
+        add_future = futures.append
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            submit = pool.submit
+            for curr, _, fns in scan_tree(str(src_root), ignore):
+                # All the files in the directory share the destination parent.
+                dst_dir = transplant_str(curr, src_root_len, dst_root_str)
+                curr = Path(curr)
+                dst = Path(dst_dir)
+                if debug:
+                    logger.debug(f"{curr = }\n{dst = }")
+
+                # The root check above already enforced the force setting, so
+                # subdirectories can only pre-exist when forcing.
+                if dst != dst_root:
+                    try:
+                        os.makedirs(dst_dir, exist_ok=True)
+                    except FileExistsError as e:
+                        logger.error(f"Error while copying files: {e}")
+                        return 17
 
-            if dst != dst_root:
-                try:
-                    dst.mkdir(exist_ok=self._force)
-                except FileExistsError as e:
-                    logger.error(f"Error while copying files: {e}")
-                    return 17
+                if preserve_dir_stat:
+                    dirs.append((curr, dst))
 
+                for f in fns:
+                    f_dst = os.path.join(dst_dir, f.name)
+                    name = f.path[src_root_len:]
+                    add_future(submit(copy_task, f, f_dst, name))
+
+            if on_count is not None:
+                on_count(len(futures))
+
+        # Report the first error that happened during the copies, if any.
+        for fut in futures:
+            try:
+                fut.result()
+            except OSError as e:
+                logger.error(f"Error while copying files: {e}")
+                return e.errno or 5  # EIO: I/O error
+
+        # Copying the files changes the directory timestamps, hence the
+        # metadata is copied afterwards, children before parents.
+        for curr, dst in reversed(dirs):
             shutil.copystat(curr, dst)
 
-            dns[:] = self._remove_ignored(dns)
-            fns = self._remove_ignored(fns)
+        progress.flush()
 
-            for f in fns:
-                f_src_path = curr.joinpath(Path(f))
-                f_dst_path = transplant_path(f_src_path, src_root, dst_root)
-                f_disp = f_src_path.relative_to(src_root)
-                description = f"Copying {f_disp}"
-                cb(str(description))
-                shutil.copy2(f_src_path, f_dst_path)
+        return self._symlink()
 
-        self._symlink()
-
-        return 0
-
-    def archive(self, cb: Callable[[str], None]) -> int:
+    def archive(
+            self,
+            cb: Callable[[int, str], None],
+            on_count: Optional[Callable[[int], None]] = None
+    ) -> int:
         """Archive the files to a compressed file.
 
-        :param cb: Callback, called once for each processed file.
+        :param cb: Progress callback, called with the number of files processed
+            since its previous call and a description of the last one.
+        :param on_count: Optional callback, called with the total number of
+            files to process as soon as the source tree has been walked, while
+            the processing may still be ongoing.
         :return: An error code. Follows errno conventions (as much as possible).
         """
         src_root = self.src
         dst_root = self.dst
         logger.debug(f"{src_root = }\n{dst_root = }")
         basename = dst_root.with_suffix("")
-        if basename.exists():
-            if self.force:
-                warnings.warn(f"{basename} already exists, will be removed.")
+        if self.force:
+            try:
                 shutil.rmtree(str(basename))
-            else:
-                logger.error(f"{basename} already exists.")
-                return 17
+                logger.warning(f"{basename} already existed, and was removed.")
+            except FileNotFoundError:
+                pass
+        elif basename.exists():
+            logger.error(f"{basename} already exists.")
+            return 17
 
         mode = "w" if self.force else "a"
 
@@ -190,57 +512,103 @@ class FileProcessor:
             dst_root,
             mode=mode,
             compression=ZIP_DEFLATED,
-            compresslevel=9,
+            compresslevel=self._compresslevel,
+            allowZip64=True,
         )
 
-        with zipf as z:
-            for curr, dns, fns in os.walk(src_root):
-                curr = Path(curr).resolve()
+        # Worker threads read small files ahead, so that reading overlaps with
+        # the compression (zlib releases the GIL) done by this thread, which
+        # writes the members in order.
+        src_root_len = len(os.path.join(str(src_root), ""))
+        progress = ProgressBatcher(cb, "Archiving")
+        pending: Deque[Tuple[ZipInfo, int, Future]] = deque()
+        window = 2 * self._workers
+
+        def write_pending(limit: int):
+            while len(pending) > limit:
+                zinfo, ctype, fut = pending.popleft()
+                progress(zinfo.filename)
+                z.writestr(
+                    zinfo,
+                    fut.result(),
+                    compress_type=ctype,
+                    compresslevel=self._compresslevel
+                )
+
+        # Bind to locals what is looked up on every iteration.
+        debug = logger.isEnabledFor(logging.DEBUG)
+        ignore = self._ignore_re
+        add_pending = pending.append
+        nfiles = 0
+
+        with zipf as z, ThreadPoolExecutor(max_workers=self._workers) as pool:
+            submit = pool.submit
+            for curr, _, fns in scan_tree(str(src_root), ignore):
+                nfiles += len(fns)
+                curr = Path(curr)
                 dst = transplant_path(curr, src_root, None)
-                logger.debug(f"{curr = }\n{dst = }")
+                if debug:
+                    logger.debug(f"{curr = }\n{dst = }")
 
                 if dst != dst_root:
+                    write_pending(0)
                     z.mkdir(str(dst))
 
-                dns[:] = self._remove_ignored(dns)
-                fns = self._remove_ignored(fns)
-
                 for f in fns:
-                    f_src_path = curr.joinpath(Path(f))
-                    f_dst_path = f_src_path.relative_to(src_root)
-                    description = f"Archiving {f_dst_path}"
-                    cb(description)
-                    z.write(f_src_path, arcname=f_dst_path)
+                    f_dst_path = f.path[src_root_len:]
+                    suffix = os.path.splitext(f.name)[1].lower()
+                    if suffix in STORED_SUFFIXES:
+                        ctype = ZIP_STORED
+                    else:
+                        ctype = ZIP_DEFLATED
 
-        self._symlink()
+                    zinfo = zipinfo_from_entry(f, f_dst_path)
 
-        return 0
+                    if zinfo.file_size > PREFETCH_MAXSIZE:
+                        write_pending(0)
+                        progress(f_dst_path)
+                        zinfo.compress_type = ctype
+                        # As ZipFile.write does, no public setter exists.
+                        zinfo._compresslevel = self._compresslevel
+                        with (
+                            open(f.path, "rb") as fsrc,
+                            z.open(zinfo, "w", force_zip64=True) as fdst
+                        ):
+                            shutil.copyfileobj(fsrc, fdst, COPY_BUFSIZE)
+                        continue
 
-    def _remove_ignored(self, names: Iterable[AnyStr]) -> List[str]:
-        """Remove directories and files that should be ignored.
+                    fut = submit(read_file, f.path)
+                    add_pending((zinfo, ctype, fut))
+                    write_pending(window)
 
-        :param names: The filenames to filter
-        :return: The filtered filenames
+            if on_count is not None:
+                on_count(nfiles)
+
+            write_pending(0)
+
+        progress.flush()
+
+        return self._symlink()
+
+    def _symlink(self) -> int:
+        """Create a symlink of destination to outpath appropriate.
+
+        :return: An error code. Follows errno conventions (as much as possible).
         """
-        ignor: set[str] = set()
-        for patt in self._ignore_patterns:
-            matchsetd = set(fnmatch.filter(names, patt))
-            ignor = ignor.union(matchsetd)
-        return [x for x in names if x not in ignor]
-
-    def _symlink(self):
-        """Create a symlink of destination to outpath appropriate."""
         link_dst = self.link_path
         dst_root = self.dst
         if link_dst is not None:
             logger.info(f"Linking {dst_root} to {link_dst}")
-            if link_dst.exists():
-                if self._force:
-                    os.remove(link_dst)
-                else:
+            try:
+                link_dst.symlink_to(dst_root)
+            except FileExistsError:
+                if not self._force:
                     logger.error(f"{link_dst} already exists")
                     return 17
-            link_dst.symlink_to(dst_root)
+                os.remove(link_dst)
+                link_dst.symlink_to(dst_root)
         else:
             logger.info(
                 "Output path equal to repo path, skipping symlink creation.")
+
+        return 0
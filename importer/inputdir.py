@@ -1,19 +1,121 @@
 """Choose input directories."""
 
+import ctypes
+import errno
+import functools
+import heapq
 import logging
 import os
-import warnings
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum, auto
 from pathlib import Path
-from typing import List, Optional, Union
-
-import questionary
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from importer.statuscb import StatusCB
 
 logger = logging.getLogger("importer.inputdir")
 
+# Constants for statx(2), from linux/fcntl.h and linux/stat.h.
+AT_FDCWD = -100
+AT_STATX_DONT_SYNC = 0x4000
+STATX_MTIME = 0x40
+
+
+class StatxTimestamp(ctypes.Structure):
+    """The struct statx_timestamp of statx(2)."""
+
+    _fields_ = [
+        ("tv_sec", ctypes.c_int64),
+        ("tv_nsec", ctypes.c_uint32),
+        ("__reserved", ctypes.c_int32),
+    ]
+
+
+class Statx(ctypes.Structure):
+    """The struct statx of statx(2), up to the fields that are read."""
+
+    _fields_ = [
+        ("stx_mask", ctypes.c_uint32),
+        ("stx_blksize", ctypes.c_uint32),
+        ("stx_attributes", ctypes.c_uint64),
+        ("stx_nlink", ctypes.c_uint32),
+        ("stx_uid", ctypes.c_uint32),
+        ("stx_gid", ctypes.c_uint32),
+        ("stx_mode", ctypes.c_uint16),
+        ("__spare0", ctypes.c_uint16),
+        ("stx_ino", ctypes.c_uint64),
+        ("stx_size", ctypes.c_uint64),
+        ("stx_blocks", ctypes.c_uint64),
+        ("stx_attributes_mask", ctypes.c_uint64),
+        ("stx_atime", StatxTimestamp),
+        ("stx_btime", StatxTimestamp),
+        ("stx_ctime", StatxTimestamp),
+        ("stx_mtime", StatxTimestamp),
+        # the kernel writes the whole 256 bytes structure
+        ("__spare", ctypes.c_uint64 * 16),
+    ]
+
+
+def load_statx() -> Optional[Callable[..., int]]:
+    """Load the statx function from the C library, if available.
+
+    :return: The statx function, or None if it is not available.
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+
+    try:
+        fn = ctypes.CDLL(None, use_errno=True).statx
+    except (OSError, AttributeError):
+        return None
+
+    fn.argtypes = [
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_uint,
+        ctypes.POINTER(Statx),
+    ]
+    fn.restype = ctypes.c_int
+    return fn
+
+
+# Cleared if the kernel turns out not to support statx.
+STATX = load_statx()
+
+
+def statx_mtime(path: Union[str, os.DirEntry]) -> float:
+    """Get the modification time of a file, without syncing it.
+
+    Only the modification time is requested, with AT_STATX_DONT_SYNC, so that
+    network filesystems can answer from their cached attributes. Falls back to
+    os.stat (or to the cached stat of a DirEntry) if statx is not available or
+    fails.
+
+    :param path: The path of the file, or its entry from os.scandir.
+    :return: The modification time, in seconds since the epoch.
+    """
+    global STATX
+    if STATX is not None:
+        buf = Statx()
+        ret = STATX(
+            AT_FDCWD,
+            os.fsencode(path),
+            AT_STATX_DONT_SYNC,
+            STATX_MTIME,
+            ctypes.byref(buf)
+        )
+        if ret == 0 and buf.stx_mask & STATX_MTIME:
+            return buf.stx_mtime.tv_sec + buf.stx_mtime.tv_nsec * 1e-9
+        if ret != 0 and ctypes.get_errno() == errno.ENOSYS:
+            STATX = None
+
+    if isinstance(path, os.DirEntry):
+        return path.stat().st_mtime
+    return os.stat(path).st_mtime
+
 
 class InputSt(Enum):
     """Which input strategy is needed."""
@@ -33,6 +135,11 @@ class InputDIR:
         given value. Overrides inpath.
     :param inpath: If not None, get the directory with the specified path.
     :param search_cb: StatusCB instance to be called before and after the search.
+    :param threads: Number of threads scanning directories concurrently during
+        the search, defaults to 1.
+    :param inode_order: Whether directories should be stat'ed in inode order
+        during the search, which limits seeks on spinning disks, defaults to
+        False.
     """
 
     def __init__(
@@ -41,7 +148,9 @@ class InputDIR:
             date: Optional[datetime],
             inpath: Optional[Path],
             root: Optional[Path],
-            search_cb: StatusCB = StatusCB()
+            search_cb: StatusCB = StatusCB(),
+            threads: int = 1,
+            inode_order: bool = False
     ):
         """Initialize the instance."""
         self._today = today
@@ -49,19 +158,25 @@ class InputDIR:
         self._inpath = inpath
         self._root = root
         self._search_cb = search_cb
+        self._threads = threads
+        self._inode_order = inode_order
         self._strategy = self._choose_strategy()
+        self._path_fn: Callable[[], Optional[Path]] = {
+            InputSt.TODAY: self._get_today_dir,
+            InputSt.DATE: self._get_date_dir,
+            InputSt.PATH: self._get_path_dir,
+            InputSt.INTERACTIVE: self._get_interactive_dir,
+        }[self._strategy]
 
     def _choose_strategy(self):
-        """Choose an input strategy, according to override rules."""
+        """Choose an input strategy, according to override rules.
+
+        Conflicting inputs are silently overridden: warning about them is up to
+        the caller.
+        """
         if self._today:
-            if self._date is not None:
-                warnings.warn("Today input will override date.")
-            if self._inpath is not None:
-                warnings.warn("Today input will override path.")
             return InputSt.TODAY
         elif self._date is not None:
-            if self._inpath is not None:
-                warnings.warn("Date input will override path.")
             return InputSt.DATE
         elif self._inpath is not None:
             return InputSt.PATH
@@ -74,24 +189,39 @@ class InputDIR:
         :return: An (optional) path representing the selected directory.
         """
         date = datetime.now()
-        return date_dir(date=date, root=self._root, scb=self._search_cb)
+        return date_dir(
+            date=date,
+            root=self._root,
+            scb=self._search_cb,
+            threads=self._threads,
+            inode_order=self._inode_order
+        )
 
     def _get_date_dir(self) -> Optional[Path]:
         """Get directory with modification date closest to required date.
 
         :return: An (optional) path representing the selected directory.
         """
-        return date_dir(date=self._date, root=self._root, scb=self._search_cb)
+        return date_dir(
+            date=self._date,
+            root=self._root,
+            scb=self._search_cb,
+            threads=self._threads,
+            inode_order=self._inode_order
+        )
 
     def _get_path_dir(self) -> Optional[Path]:
         """Get the directory with the inputh path.
 
+        The path is only normalized as a string, without filesystem access:
+        symlinks are resolved later, by the file processor.
+
         :return: An (optional) path representing the selected directory.
         """
         path = self._inpath
         if self._root is not None and not path.is_absolute():
             path = self._root.joinpath(path)
-        return path.resolve()
+        return Path(os.path.abspath(path))
 
     def _get_interactive_dir(self) -> Optional[Path]:
         """Interactively get the input path.
@@ -106,15 +236,7 @@ class InputDIR:
 
         :return: An (optional) path representing the selected directory.
         """
-        match self._strategy:
-            case InputSt.TODAY:
-                return self._get_today_dir()
-            case InputSt.DATE:
-                return self._get_date_dir()
-            case InputSt.PATH:
-                return self._get_path_dir()
-            case InputSt.INTERACTIVE:
-                return self._get_interactive_dir()
+        return self._path_fn()
 
     def __repr__(self) -> str:
         """Representation for debugging."""
@@ -127,69 +249,180 @@ class InputDIR:
         )
 
 
-def date_dir(date: datetime, root: Optional[Path], scb: StatusCB) -> Optional[Path]:
+def date_dir(
+        date: datetime,
+        root: Optional[Path],
+        scb: StatusCB,
+        threads: int = 1,
+        inode_order: bool = False
+) -> Optional[Path]:
     """Get directory with modification date closest to required.
 
     :param date: The required date.
     :param root: The root under which the directory is to be searched. If None,
         search under "./".
     :param scb: A StatusCB to start and stop the status during the search.
+    :param threads: Number of threads scanning directories concurrently,
+        defaults to 1.
+    :param inode_order: Whether directories should be stat'ed in inode order,
+        defaults to False.
     :return: An (optional) path representing the selected directory.
     """
     if root is None:
         root = Path("./").resolve()
     scb.start()
-    found = find_date_dir(date, root)
-    scb.stop()
+    try:
+        found = find_date_dir(
+            date, root, threads=threads, inode_order=inode_order)
+    finally:
+        scb.stop()
     return dir_selector(found)
 
 
-def find_date_dir(date: datetime, root: Path, n: int = 10) -> List[Path]:
+def find_date_dir(
+        date: datetime,
+        root: Path,
+        n: int = 10,
+        threads: int = 1,
+        slack: float = 0.0,
+        inode_order: bool = False
+) -> List[Path]:
     """Find best matching directories in the root path.
 
+    The search is a heuristic, best-first branch and bound. As the walk it
+    replaces, it only descends into the directories that are among the n best
+    when their parent is listed. Then, it assumes that the modification time of
+    a directory is later than those of its descendants (which is the case if
+    they were created in chronological order): no descendant of a directory
+    older than the date is expected to score better than the directory itself,
+    while a newer directory gives no bound. Directories are visited in order of
+    this bound, and the search stops as soon as no unvisited directory could
+    improve on the n best found so far. Hence, in trees that are not
+    chronological, a better directory under a worse scoring one may be missed.
+
     :param date: The required date.
     :param root: The root under which the directory should be searched.
     :param n: The number of matches, defaults to 10.
-    :return: The list of the best matching directories.
+    :param threads: The number of threads scanning directories concurrently,
+        defaults to 1. More threads hide the latency of network filesystems,
+        without changing the result.
+    :param slack: How much (in seconds) descendants of older directories may
+        score better than their ancestors, for trees that are not strictly
+        chronological, defaults to 0. It only loosens the bound: directories
+        outside the n best are not descended into anyway.
+    :param inode_order: Whether the sub-directories of each directory should be
+        stat'ed in inode order, defaults to False. On spinning disks this keeps
+        the reads of the inode table close together; on SSDs it only adds a
+        sort.
+    :return: The list of the best matching directories, best first.
     """
-    found = []
-
-    for curr, subdns, _ in os.walk(root):
-        # append current directory if none visited
-        if len(found) == 0:
-            found.append((curr, Path(curr), datescore_dir(curr, date)))
-
-        # find scores for all sub-directories
-        subdps = [(d, Path(curr).joinpath(d).resolve())
-                  for d in subdns]
-        subdss = [(d, p, datescore_dir(p, date)) for d, p in subdps]
-
-        # keep only subdss members that would be in top ten
-        subdss.sort(key=lambda x: x[2])
-        found[:] = found + subdss
-        found.sort(key=lambda x: x[2])
-        found[:] = found[:min(len(found), n)]
-        max_found = found[-1][2]
-        subdss = [(d, s) for d, _, s in subdss if s <= max_found]
-
-        # traverse only subdirectories in subdss (i.e. directories in top ten)
-        subdns[:] = [d for d, _ in subdss]
-
-    found = [x[1] for x in found]
-    return found
-
-
-def datescore_dir(dir: Path, target: datetime) -> int:
-    """Score directory according to distance from date.
-
-    :param dir: The directory to be scored.
-    :param target: The target date.
-    :return: The distance of the modification date of the directory from the
-        target date (in seconds).
+    # resolved once, so that all the entry paths below are already absolute
+    root_str = str(root.resolve())
+    target = date.timestamp()
+    root_off = statx_mtime(root_str) - target
+
+    def bound(off: float) -> float:
+        """Expected lower bound on the scores of the descendants."""
+        return max(0.0, -off - slack) if off <= 0 else 0.0
+
+    # max-heap (on negated scores) of the best n directories; the counter
+    # keeps the first found on ties
+    found = [(-abs(root_off), 0, root_str)]
+    count = 0
+
+    def pruned(lb: float) -> bool:
+        """Whether no directory with this bound can enter the n best."""
+        return len(found) == n and lb > -found[0][0]
+
+    def update(
+            subdss: List[Tuple[str, float, bool]]
+    ) -> List[Tuple[float, str]]:
+        """Add scored sub-directories to found.
+
+        :return: The sub-directories to traverse.
+        """
+        nonlocal count
+        # only the n best can enter the top ten: on large listings, select
+        # them in a single pass instead of pushing every entry
+        best = subdss
+        if len(subdss) > n:
+            best = heapq.nsmallest(n, subdss, key=lambda x: abs(x[1]))
+
+        # keep only the top ten
+        for p, off, _ in best:
+            count += 1
+            item = (-abs(off), -count, p)
+            if len(found) < n:
+                heapq.heappush(found, item)
+            else:
+                heapq.heappushpop(found, item)
+        max_found = -found[0][0]
+
+        # traverse only subdirectories in the top ten (symlinks are not
+        # followed, as in os.walk)
+        return [(bound(off), p) for p, off, link in subdss
+                if abs(off) <= max_found and not link]
+
+    # each directory is stat'ed once, as an entry of its parent's listing: its
+    # offset travels in the queue, so no score needs to be recomputed
+    queue = [(bound(root_off), root_str)]
+    # the pool prefetches the scans of the directories at the top of the
+    # queue, hiding their latency; the results are still merged in queue
+    # order, so they do not depend on the order in which scans complete
+    prefetched: Dict[str, Future] = {}
+    pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    try:
+        while queue:
+            lb, curr = heapq.heappop(queue)
+            if pruned(lb):
+                break
+            fut = prefetched.pop(curr, None)
+            if fut is not None:
+                subdss = fut.result()
+            else:
+                subdss = scan_subdirs(curr, target, inode_order)
+            for item in update(subdss):
+                heapq.heappush(queue, item)
+            if pool is not None:
+                # the same rule as above: the pruned are not even prefetched
+                for lb, p in queue[:threads]:
+                    if p not in prefetched and not pruned(lb):
+                        prefetched[p] = pool.submit(
+                            scan_subdirs, p, target, inode_order)
+    finally:
+        if pool is not None:
+            # the scans still queued (prefetched for pruned directories, or
+            # left by an interrupted search) are not waited for
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return [Path(p) for _, _, p in sorted(found, reverse=True)]
+
+
+def scan_subdirs(
+        dir: str,
+        target: float,
+        inode_order: bool = False
+) -> List[Tuple[str, float, bool]]:
+    """Get the modification times of the sub-directories of a directory.
+
+    :param dir: The directory whose sub-directories are scanned.
+    :param target: The required date, as a timestamp.
+    :param inode_order: Whether the sub-directories should be stat'ed (and
+        returned) in inode order, defaults to False.
+    :return: A list of tuples (path, modification time minus target, whether
+        it is a symlink). The list is empty if the directory cannot be listed.
     """
-    mtime = datetime.fromtimestamp(os.stat(dir).st_mtime)
-    delta = mtime - target
-    return abs(int(delta.total_seconds()))
+    try:
+        with os.scandir(dir) as it:
+            entries = [e for e in it if e.is_dir()]
+    except OSError as e:
+        # an unreadable directory must not abort the whole search
+        logger.debug(f"Cannot scan `{dir}`: {e}")
+        return []
+    if inode_order:
+        # the inode number comes with the directory listing, no stat needed
+        entries.sort(key=os.DirEntry.inode)
+    return [(e.path, statx_mtime(e) - target, e.is_symlink()) for e in entries]
 
 
 def dir_selector(found: List[Path]) -> Optional[Path]:
@@ -199,6 +432,9 @@ def dir_selector(found: List[Path]) -> Optional[Path]:
     :return: A Path to the input directory, or None if the user cancels (with
         C-c).
     """
+    # Imported here, as it is slow to import and only needed if prompting.
+    import questionary
+
     foundstr = [str(x) for x in found]
     ans = questionary.select(
         "Best matches:",
@@ -217,13 +453,19 @@ def dir_input(root: Optional[Path]) -> Optional[Path]:
         seeks under "./"
     :return: The path of the chosen input directory, or None if user cancels.
     """
+    import questionary
+
     if root is None:
         root = Path(".")
     logger.debug(f"{root = }")
 
+    # The validation runs on every keystroke: remember the answers for the
+    # prompt session, not to stat the (remote) paths again and again.
+    isdir = functools.lru_cache(maxsize=256)(os.path.isdir)
+
     def validate_dir(dir: str) -> Union[bool, str]:
         """Directory validation for questionary."""
-        if os.path.isdir(dir):
+        if isdir(dir):
             return True
         else:
             return "Not a directory"
@@ -4,18 +4,15 @@ import ipaddress
 import logging
 import os
 import pathlib
+import re
 import warnings
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 from typing import Any, Dict, Optional, Union
 
 import click
-import questionary
-from rich import box
 from rich.console import Console
 from rich.logging import RichHandler
-from rich.progress import Progress
-from rich.status import Status
-from rich.table import Table
 
 from .fileproc import FileProcessor
 from .inputdir import InputDIR
@@ -49,6 +46,8 @@ def formatwarning(
     filename
     lineno
     line
+    if isinstance(message, str):
+        return message
     return str(message)
 
 
@@ -64,6 +63,13 @@ CONTEXT_SETTINGS = {
 
 CliOption = Union[str, int, bool, None]
 
+VERBOSITY = (logging.WARNING, logging.INFO, logging.DEBUG)
+
+# Dates that date.fromisoformat can parse as strptime would. It also accepts
+# other ISO 8601 forms (e.g. "20240510", "2024-W19-5"), which are not dates
+# for --date.
+ISO_DATE_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+
 
 @ click.group(
     help="Import files from a server.",
@@ -148,6 +154,46 @@ CliOption = Union[str, int, bool, None]
     show_envvar=True,
     help="Compress imported folder"
 )
+@ click.option(
+    "--compress-level",
+    "compress_level",
+    default=6,
+    type=click.IntRange(min=0, max=9),
+    help="Deflate level of the archive: lower is faster, higher is smaller.",
+    envvar="IMPORTER_COMPRESS_LEVEL",
+    show_envvar=True,
+    show_default=True,
+)
+@ click.option(
+    "--stat-threads",
+    "stat_threads",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Threads scanning remote directories concurrently when searching.",
+    envvar="IMPORTER_STAT_THREADS",
+    show_envvar=True,
+    show_default=True,
+)
+@ click.option(
+    "--copy-threads",
+    "copy_threads",
+    default=8,
+    type=click.IntRange(min=1),
+    help="Threads copying (or reading, when compressing) files concurrently. "
+    "Raise it for many small files on a remote mount.",
+    envvar="IMPORTER_COPY_THREADS",
+    show_envvar=True,
+    show_default=True,
+)
+@ click.option(
+    "--inode-order",
+    "inode_order",
+    is_flag=True,
+    help="Stat remote directories in inode order when searching (faster on "
+    "spinning disks).",
+    envvar="IMPORTER_INODE_ORDER",
+    show_envvar=True,
+)
 @ click.option(
     "-v",
     "--verbose",
@@ -205,17 +251,13 @@ def set_verbosity(level: int):
 
     :param level: Verbosity level.
     """
-    if level <= 0:
-        logger.setLevel(logging.WARNING)
-    elif level == 1:
-        logger.setLevel(logging.INFO)
-    elif level >= 2:
-        logger.setLevel(logging.DEBUG)
-
     # overrides cli flag
-    if "IMPORTER_DEBUG" in os.environ.keys():
+    if "IMPORTER_DEBUG" in os.environ:
         logger.setLevel(logging.DEBUG)
         logger.debug("Logging level set to debug via envvar IMPORTER_DEBUG.")
+        return
+
+    logger.setLevel(VERBOSITY[min(max(level, 0), len(VERBOSITY) - 1)])
 
 
 def imprtf(kwargs: Dict["str", CliOption]):
@@ -242,14 +284,25 @@ def imprtf(kwargs: Dict["str", CliOption]):
 
         logger.debug(f"{indir = }")
 
-        outpath = kwargs["outpath"].resolve()
-        repopath = kwargs["repopath"].resolve()
+        # FileProcessor resolves them, no need to do it twice.
+        outpath = kwargs["outpath"]
+        repopath = kwargs["repopath"]
         if not paths_good(indir, outpath, repopath):
             return 2  # ENOENT
 
         compress = kwargs["compress"]
         force = kwargs["force"]
-        ret = process(indir, outpath, repopath, compress, force)
+        copy_threads = kwargs["copy_threads"]
+        compress_level = kwargs["compress_level"]
+        ret = process(
+            indir,
+            outpath,
+            repopath,
+            compress,
+            force,
+            workers=copy_threads,
+            compresslevel=compress_level,
+        )
 
         if ret != 0:
             return ret
@@ -268,19 +321,14 @@ def build_remote_repo(kwargs: Dict) -> Optional[RemoteRepo]:
     server_ip = kwargs["server_ip"]
     server_check = kwargs["server_check"]
 
-    if mountpoint is not None:
-        try:
-            mountpoint = pathlib.Path(mountpoint)
-        except Exception as e:
-            logger.error(e)
-            return None
-
     try:
         server_ip = ipaddress.ip_address(server_ip)
     except Exception as e:
         logger.error(e)
         return None
 
+    from rich.status import Status
+
     ck_status = Status("Checking remote server.")
     ck_st_cb = StatusCB(start=ck_status.start, stop=ck_status.stop)
 
@@ -306,26 +354,25 @@ def get_input_directory(kwargs: Dict[str, CliOption]) -> Optional[pathlib.Path]:
     datepath = kwargs["datepath"]
     inpath = kwargs["inpath"]
     mountpoint = kwargs["mountpoint"]
+    stat_threads = kwargs["stat_threads"]
+    inode_order = kwargs["inode_order"]
+
+    if today:
+        if datepath is not None:
+            logger.warning("Today input will override date.")
+        if inpath is not None:
+            logger.warning("Today input will override path.")
+    elif datepath is not None and inpath is not None:
+        logger.warning("Date input will override path.")
 
     if datepath is not None:
         try:
-            datepath = datetime.strptime(f"{datepath}-13", "%Y-%m-%d-%H")
+            datepath = parse_date(datepath)
         except Exception as e:
             logger.error(e)
             return None
 
-    if inpath is not None:
-        try:
-            inpath = pathlib.Path(inpath)
-        except Exception as e:
-            logger.error(e)
-            return None
-
-    try:
-        mountpoint = pathlib.Path(mountpoint)
-    except Exception as e:
-        logger.error(e)
-        return None
+    from rich.status import Status
 
     search_st = Status("Searching for matching directories")
     search_st_cb = StatusCB(start=search_st.start, stop=search_st.stop)
@@ -336,6 +383,8 @@ def get_input_directory(kwargs: Dict[str, CliOption]) -> Optional[pathlib.Path]:
         inpath=inpath,
         root=mountpoint,
         search_cb=search_st_cb,
+        threads=stat_threads,
+        inode_order=inode_order,
     )
 
     logger.debug(f"{dir = }")
@@ -343,28 +392,49 @@ def get_input_directory(kwargs: Dict[str, CliOption]) -> Optional[pathlib.Path]:
     return dir.path
 
 
+def parse_date(datestr: str) -> datetime:
+    """Parse a date given on the command line.
+
+    Zero-padded dates are parsed by date.fromisoformat, strptime handles the
+    rest (e.g. non zero-padded days).
+
+    :param datestr: The date, in the format YYYY-MM-DD.
+    :return: The date, at 13:00.
+    """
+    if ISO_DATE_RE.fullmatch(datestr) is None:
+        return datetime.strptime(f"{datestr}-13", "%Y-%m-%d-%H")
+    d = date.fromisoformat(datestr)
+    return datetime(d.year, d.month, d.day, 13)
+
+
 def paths_good(inpath: pathlib.Path, outpath: pathlib.Path, repopath: pathlib.Path) -> bool:
     """Check for the given input/output paths.
 
+    The paths may lie on network mounts, hence they are checked concurrently,
+    and each distinct path only once (the output and repository paths are
+    often the same).
+
     :param inpath: The input directory path.
     :param outpath: The path to which the files should be symlinked.
     :param repopath: The path to which the files should be copied.
     :return: If the paths are correct (True) or not (False).
     """
-    if not inpath.is_dir():
-        logger.error(f"Specified input path {inpath} is not a directory.")
-        return False
-
-    if not outpath.is_dir():
-        logger.error(f"Specified output path {outpath} is not a directory.")
-        return False
+    checks = [
+        (inpath, "input path"),
+        (outpath, "output path"),
+        (repopath, "repository path"),
+    ]
+    paths = list(dict.fromkeys(p for p, _ in checks))
+    with ThreadPoolExecutor(max_workers=len(paths)) as pool:
+        is_dir = dict(zip(paths, pool.map(os.path.isdir, paths)))
 
-    if not repopath.is_dir():
-        logger.error(
-            f"Specified repository path {repopath} is not a directory.")
-        return False
+    good = True
+    for path, what in checks:
+        if not is_dir[path]:
+            logger.error(f"Specified {what} {path} is not a directory.")
+            good = False
 
-    return True
+    return good
 
 
 def process(
@@ -372,7 +442,9 @@ def process(
         outpath: pathlib.Path,
         repopath: pathlib.Path,
         compress: bool,
-        force: bool
+        force: bool,
+        workers: int = 8,
+        compresslevel: int = 6
 ) -> int:
     """Process the files to destination.
 
@@ -380,6 +452,9 @@ def process(
     :param outpath: The path to the output symlink location.
     :param repopath: The path to the repository location.
     :param force: Whether existing files should be overwritten.
+    :param workers: Number of threads copying files concurrently, defaults
+        to 8.
+    :param compresslevel: Deflate level for archives, defaults to 6.
     :return: An exit code, following (as much as possible) errno conventions.
     """
     proc = FileProcessor(
@@ -388,24 +463,38 @@ def process(
         repopath=repopath,
         compress=compress,
         force=force,
-        ignore_patterns=["*.sis"]
+        ignore_patterns=["*.sis"],
+        workers=workers,
+        compresslevel=compresslevel,
     )
 
     if not process_confirm(proc):
         return 125
 
-    nfiles = proc.count_files()
-    logger.info(f"There are {nfiles} files to process.")
+    # Imported here, as the other UI modules, not to slow down the start up
+    # (e.g. for --help).
+    from rich.progress import Progress
+
+    # The total is unknown until the source tree has been walked, which is
+    # done while processing the files.
     pbar = Progress(console=cns, transient=True)
-    ctask = pbar.add_task(total=nfiles, description="Processing files:")
+    ctask = pbar.add_task(total=None, description="Processing files:")
 
-    def pbar_upd(description: str):
-        pbar.update(ctask, advance=1, description=description)
+    def pbar_upd(advance: int, description: str):
+        pbar.update(ctask, advance=advance, description=description)
+
+    def pbar_total(nfiles: int):
+        logger.info(f"There are {nfiles} files to process.")
+        pbar.update(ctask, total=nfiles)
 
     pbar.start()
-    ret = proc(cb=pbar_upd)
-    pbar.stop()
-    cns.print("[bold green]Done.")
+    try:
+        ret = proc(cb=pbar_upd, on_count=pbar_total)
+    finally:
+        pbar.stop()
+
+    if ret == 0:
+        cns.print("[bold green]Done.")
 
     return ret
 
@@ -416,6 +505,9 @@ def process_confirm(proc: FileProcessor) -> bool:
     :param proc: The file processor from which the information should be pulled.
     :return: Whether the user confirmed.
     """
+    from rich import box
+    from rich.table import Table
+
     tbl = Table(
         show_header=False,
         width=cns.width,
@@ -449,9 +541,11 @@ def process_confirm(proc: FileProcessor) -> bool:
 
     cns.print(tbl)
 
-    ans = questionary.confirm("Confirm?").ask()
+    # A plain click prompt: prompt_toolkit would be loaded just for a y/n.
+    try:
+        ans = click.confirm("Confirm?", default=True)
+    except click.Abort:
+        ans = False
     logger.debug(f"{ans = }")
-    if ans is not None:
-        return ans
 
-    return False
+    return ans
@@ -1,10 +1,12 @@
 """Manage the remote repository."""
 import logging
-import warnings
+import os
+import re
+import shutil
 from ipaddress import IPv4Address, IPv6Address, ip_address
 from pathlib import Path
-from subprocess import CompletedProcess, run
-from typing import Optional, Tuple, Union
+from subprocess import DEVNULL, PIPE, CompletedProcess, TimeoutExpired, run
+from typing import List, Optional, Tuple, Union
 
 from .statuscb import StatusCB
 
@@ -14,6 +16,21 @@ IPAddr = Union[IPv4Address, IPv6Address]
 
 LOCALHOST = ip_address("127.0.0.1")
 
+# Seconds to wait for umount, not to hang on exit if the server is gone.
+UMOUNT_TIMEOUT = 30.0
+
+# Fields of the ping summary, e.g. (iputils):
+#   PING 127.0.0.1 (127.0.0.1) 56(84) bytes of data.
+#   ...
+#   3 packets transmitted, 3 received, 0% packet loss, time 2003ms
+#   rtt min/avg/max/mdev = 0.031/0.040/0.050/0.008 ms
+PING_RE = re.compile(
+    r"^PING (\S+).*?"
+    r"(\d+) packets transmitted, (\d+) (?:packets )?received.*?"
+    r"min/avg/max\S* = ([\d.]+)/[\d.]+/([\d.]+)\S* (\w+)",
+    re.MULTILINE | re.DOTALL
+)
+
 
 class RemoteRepo:
     """Remote repository as context.
@@ -42,19 +59,25 @@ class RemoteRepo:
             self._passthrough = True
         else:
             self._passthrough = False
-        self._server_ip = ip_address(server_ip)
+        if isinstance(server_ip, (IPv4Address, IPv6Address)):
+            self._server_ip = server_ip
+        else:
+            self._server_ip = ip_address(server_ip)
         self._server_ck = server_ck
         self._ck_st_cb = ck_st_cb
         self._mnt_st_cb = mnt_st_cb
 
     def _ip_ck_needed(self) -> bool:
-        """If a check of the IP is needed."""
+        """If a check of the IP is needed.
+
+        If not specified, the check is done unless the IP is localhost.
+        """
         if self._server_ck is None:
             if self._server_ip == LOCALHOST:
                 logger.info("Server ip is localhost, skipping check.")
-                return True
-            else:
                 return False
+            else:
+                return True
 
         return self._server_ck
 
@@ -69,7 +92,7 @@ class RemoteRepo:
 
         if self._ip_ck_needed():
             self._ck_st_cb.start()
-            ip_good, msg = self._ip_ck()
+            ip_good, msg = ping(self._server_ip)
             self._ck_st_cb.stop()
 
             if not ip_good:
@@ -88,7 +111,9 @@ class RemoteRepo:
 
         logger.info(msg)
 
-        return self._mountpoint.resolve()
+        # No need to resolve it: symlinks are resolved by the users of the
+        # path, if needed.
+        return Path(os.path.abspath(self._mountpoint))
 
     def __exit__(self, exc_type, exc_value, traceback):
         """Unmount the remote repository."""
@@ -96,21 +121,14 @@ class RemoteRepo:
             f"Exiting: {exc_type = }\n{exc_value = }\n{traceback = }")
 
         if not self._passthrough:
-            self._umnt()
+            umnt_good, msg = self._umnt()
+            if umnt_good:
+                logger.info(msg)
+            else:
+                logger.warning(msg)
 
         return False
 
-    def _ip_ck(self) -> tuple[bool, str]:
-        """Check the IP.
-
-        :return: A tuple containing a bool that indicates the success of the
-            check, and a string with a message.
-        """
-        if self._ip_ck_needed():
-            return ping(self._server_ip)
-        else:
-            return (True, "No check was performed")
-
     def _mnt(self) -> Tuple[bool, str]:
         """Mount the directory.
 
@@ -128,6 +146,34 @@ class RemoteRepo:
         return unmount_remote(self._mountpoint)
 
 
+def run_cmd(
+        cmd: List[str],
+        timeout: Optional[float] = None,
+        stdout: bool = True
+) -> CompletedProcess:
+    """Run a command, capturing its error output.
+
+    The executable is looked up in PATH beforehand: on Python 3.13 and later,
+    this lets subprocess spawn the command with posix_spawn, instead of forking
+    the interpreter. The file descriptors other than the standard ones are
+    closed in the child, not to hand them to mount or the setuid umount.
+
+    :param cmd: The command, and its arguments.
+    :param timeout: Seconds after which the command is killed, defaults to None
+        (no timeout).
+    :param stdout: Whether the standard output should be captured too (else it
+        is discarded), defaults to True.
+    :return: The completed process.
+    """
+    exe = shutil.which(cmd[0]) or cmd[0]
+    return run(
+        [exe, *cmd[1:]],
+        stdout=PIPE if stdout else DEVNULL,
+        stderr=PIPE,
+        timeout=timeout
+    )
+
+
 def ping(addr: IPAddr, npkgs: int = 3, timeout: float = 2.0) -> Tuple[bool, str]:
     """Ping the specified IP address.
 
@@ -140,7 +186,7 @@ def ping(addr: IPAddr, npkgs: int = 3, timeout: float = 2.0) -> Tuple[bool, str]
     t = float(timeout)
     cmd = ["ping", f"-c{n}", f"-l{n}", f"-W{t}", f"{addrstr}"]
     logger.debug(f"cmd = {' '.join(cmd)}")
-    ret = run(cmd, capture_output=True)
+    ret = run_cmd(cmd)
 
     if ret.returncode == 1:
         msg = f"Server at {addrstr} did not respond."
@@ -152,7 +198,8 @@ def ping(addr: IPAddr, npkgs: int = 3, timeout: float = 2.0) -> Tuple[bool, str]
         msg = parse_ping_res(ret)
         return (True, msg)
     except Exception as e:
-        warnings.warn(f"Error while parsing ping response: {e}. Continuing.")
+        logger.warning(
+            f"Error while parsing ping response: {e}. Continuing.")
         return (True, "")
 
 
@@ -160,24 +207,15 @@ def parse_ping_res(ret: CompletedProcess) -> str:
     """Parse the response of the ping command.
 
     :param ret: The return value of the subprocess call to ping command.
-    :return: A string representing the ping message. 
+    :return: A string representing the ping message.
+    :raises ValueError: If the output of ping is not recognized.
     """
     stdout = ret.stdout.decode("utf-8")
-    status_msg = stdout.split("\n")
-
-    ip_line = status_msg[0].split(" ")
-    ip = ip_line[1]
-
-    loss_line = status_msg[-3].split(" ")
-    tr = loss_line[0]
-    rec = loss_line[3]
-    loss_str = f"{tr}/{rec} packets received."
-
-    time_line = status_msg[-2].split(" ")
-    times = time_line[3].split("/")
-    tmin = times[0]
-    tmax = times[1]
-    unit = time_line[4][:-1]
+    m = PING_RE.search(stdout)
+    if m is None:
+        raise ValueError("unrecognized output")
+    ip, tr, rec, tmin, tmax, unit = m.groups()
+    loss_str = f"{rec}/{tr} packets received."
     time_str = f"Ping ({unit}): min {tmin}, max {tmax}"
 
     return f"Server check for {ip}:\n\t{loss_str}\n\t{time_str}"
@@ -193,11 +231,10 @@ def mount_remote(mountpoint: Path) -> tuple[bool, str]:
     logger.debug(f"Mounting {mountpoint = }")
     path = str(mountpoint)
 
-    ret = run(["mountpoint", path, "-q"], capture_output=True)
-    if ret.returncode == 0:
+    if os.path.ismount(path):
         return (True, f"{path} is already mounted.")
 
-    ret = run(["mount", path], capture_output=True)
+    ret = run_cmd(["mount", path], stdout=False)
     if ret.returncode == 0:
         return (True, f"Mount of {path} successful.")
     else:
@@ -214,8 +251,12 @@ def unmount_remote(mountpoint: Path) -> tuple[bool, str]:
     logger.debug(f"Unmounting {mountpoint = }")
     path = str(mountpoint)
 
-    ret = run(["umount", path], capture_output=True)
-    if ret == 0:
+    try:
+        ret = run_cmd(["umount", path], timeout=UMOUNT_TIMEOUT, stdout=False)
+    except TimeoutExpired:
+        return (False, f"Unmount of {path} timed out.")
+
+    if ret.returncode == 0:
         return (True, "Unmount successful")
     else:
-        return (False, ret.stderr.decode("utf8"))
+        return (False, ret.stderr.decode("utf8", errors="replace"))
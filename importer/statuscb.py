@@ -15,8 +15,8 @@ class StatusCB:
                  stop: Callable[[], None] = NOP
                  ):
         """Specify the start and stop callables."""
-        self._start = staticmethod(start)
-        self._stop = staticmethod(stop)
+        self._start = start
+        self._stop = stop
 
     def start(self):
         """Call start function."""
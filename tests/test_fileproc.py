@@ -0,0 +1,236 @@
+"""Tests for importer.fileproc."""
+
+import errno
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
+
+import importer.fileproc
+from importer.fileproc import (
+    PROGRESS_INTERVAL, FileProcessor, ProgressBatcher, copy_file, scan_tree)
+
+_scandir = os.scandir
+
+
+class TestScanTree(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        for rel in ("a/x", "b/y"):
+            (self.root / rel).mkdir(parents=True)
+            (self.root / rel / "f").touch()
+
+    def test_unreadable_subdir(self):
+        bad = str(self.root / "b")
+
+        # permissions are not enforced for root, hence they are not relied upon
+        def scandir(path="."):
+            if os.fspath(path) == bad:
+                raise PermissionError(13, "Permission denied", bad)
+            return _scandir(path)
+
+        with mock.patch("os.scandir", scandir), \
+                self.assertLogs("importer.fileproc", "WARNING"):
+            walked = {
+                os.path.relpath(curr, self.root): sorted(f.name for f in fs)
+                for curr, _, fs in scan_tree(str(self.root))
+            }
+        self.assertEqual(walked, {".": [], "a": [], "a/x": ["f"]})
+
+
+@unittest.skipIf(sys.platform == "darwin", "copy_file uses shutil.copy2")
+class TestCopyFile(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.src = os.path.join(tmp.name, "src")
+        self.dst = os.path.join(tmp.name, "dst")
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(self.src, "wb") as f:
+            f.write(self.data)
+
+    def kernel_copy_failing(self, err: int):
+        """Make both the kernel-side copies fail with the given errno."""
+        def fail(*args):
+            raise OSError(err, os.strerror(err))
+
+        for patch in (
+            mock.patch.object(importer.fileproc, "COPY_RANGE", True),
+            mock.patch.object(importer.fileproc, "SENDFILE", True),
+            mock.patch("os.copy_file_range", fail, create=True),
+            mock.patch("os.sendfile", fail, create=True),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_copy(self):
+        copy_file(self.src, self.dst)
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.stat(self.dst).st_mtime, os.stat(self.src).st_mtime)
+
+    def test_fallback(self):
+        # e.g. a seccomp filter denying the syscalls
+        self.kernel_copy_failing(errno.EPERM)
+        copy_file(self.src, self.dst)
+        with open(self.dst, "rb") as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_fatal(self):
+        self.kernel_copy_failing(errno.ENOSPC)
+        with self.assertRaises(OSError) as cm:
+            copy_file(self.src, self.dst)
+        self.assertEqual(cm.exception.errno, errno.ENOSPC)
+
+
+class TestProgressBatcher(unittest.TestCase):
+
+    def test_batching(self):
+        now = 100.0
+
+        def clock():
+            return now
+
+        calls = []
+        with mock.patch("time.monotonic", clock):
+            progress = ProgressBatcher(
+                lambda n, desc: calls.append((n, desc)), "Copying")
+            for i in range(100):
+                # ten files per interval
+                now += PROGRESS_INTERVAL / 10
+                progress(f"f{i}")
+            # too early to be notified
+            progress("last")
+            self.assertLessEqual(len(calls), 11)
+            self.assertNotEqual(calls[-1][1], "Copying last")
+            progress.flush()
+            progress.flush()
+
+        self.assertEqual(sum(n for n, _ in calls), 101)
+        self.assertEqual(calls[-1][1], "Copying last")
+
+    def test_flush_empty(self):
+        calls = []
+        ProgressBatcher(lambda *args: calls.append(args), "Copying").flush()
+        self.assertEqual(calls, [])
+
+
+class ProcessorTestCase(unittest.TestCase):
+    """Build a source tree, and the directories to process it to."""
+
+    FILES = {
+        "top.txt": b"top",
+        "a/one.txt": b"one",
+        "a/b/two.bin": bytes(range(256)) * 64,
+        "a/skip.sis": b"ignored",
+    }
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        base = Path(tmp.name)
+        self.src = base / "src"
+        self.out = base / "out"
+        self.repo = base / "repo"
+        self.out.mkdir()
+        self.repo.mkdir()
+        for rel, data in self.FILES.items():
+            path = self.src / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+        # children before parents, as writing a file changes its directory
+        for i, rel in enumerate(("a/b", "a", ".")):
+            os.utime(self.src / rel, (1e9 + i, 1e9 + i))
+
+    def processor(self, compress: bool, force: bool = False) -> FileProcessor:
+        return FileProcessor(
+            self.src, self.out, self.repo, compress, force,
+            ignore_patterns=["*.sis"], workers=4)
+
+    def expected(self) -> dict:
+        """The processed files, with their contents."""
+        return {rel: data for rel, data in self.FILES.items()
+                if not rel.endswith(".sis")}
+
+
+class TestCopy(ProcessorTestCase):
+
+    def test_copy(self):
+        progress = []
+        counts = []
+        ret = self.processor(False)(
+            lambda n, desc: progress.append(n), counts.append)
+        self.assertEqual(ret, 0)
+
+        dst = self.repo / "src"
+        copied = {
+            str(p.relative_to(dst)): p.read_bytes()
+            for p in dst.rglob("*") if p.is_file()
+        }
+        self.assertEqual(copied, self.expected())
+        for rel in ("a/b", "a", "."):
+            self.assertEqual(os.stat(dst / rel).st_mtime,
+                             os.stat(self.src / rel).st_mtime)
+        self.assertEqual(os.readlink(self.out / "src"), str(dst))
+        self.assertEqual(counts, [3])
+        self.assertEqual(sum(progress), 3)
+
+    def test_force(self):
+        self.assertEqual(self.processor(False)(lambda *args: None), 0)
+        with self.assertLogs("importer.fileproc", "ERROR"):
+            self.assertEqual(self.processor(False)(lambda *args: None), 17)
+        self.assertEqual(
+            self.processor(False, force=True)(lambda *args: None), 0)
+
+    def test_failing_worker(self):
+        copy = importer.fileproc.copy_file
+
+        def copy_file(src, dst):
+            if src.name == "one.txt":
+                raise PermissionError(13, "Permission denied", src.path)
+            copy(src, dst)
+
+        with mock.patch.object(importer.fileproc, "copy_file", copy_file), \
+                self.assertLogs("importer.fileproc", "ERROR"):
+            ret = self.processor(False)(lambda *args: None)
+        self.assertEqual(ret, 13)
+        self.assertFalse(os.path.lexists(self.out / "src"))
+
+
+class TestArchive(ProcessorTestCase):
+
+    FILES = {
+        **ProcessorTestCase.FILES,
+        "a/small.png": b"not deflated",
+        "a/b/large.png": os.urandom(8192),
+    }
+
+    def test_archive(self):
+        # two.bin and large.png are streamed, the others are read ahead
+        with mock.patch.object(importer.fileproc, "PREFETCH_MAXSIZE", 4096):
+            ret = self.processor(True)(lambda *args: None)
+        self.assertEqual(ret, 0)
+
+        dst = self.repo / "src.zip"
+        self.assertEqual(os.readlink(self.out / "src"), str(dst))
+        with ZipFile(dst) as z:
+            self.assertIsNone(z.testzip())
+            members = {i.filename: i for i in z.infolist() if not i.is_dir()}
+            self.assertEqual(
+                {name: z.read(name) for name in members}, self.expected())
+        for name, zinfo in members.items():
+            with self.subTest(name=name):
+                self.assertEqual(
+                    zinfo.compress_type,
+                    ZIP_STORED if name.endswith(".png") else ZIP_DEFLATED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,188 @@
+"""Tests for importer.inputdir."""
+
+import ctypes
+import errno
+import os
+import random
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from unittest import mock
+
+import importer.inputdir
+from importer.inputdir import (
+    AT_FDCWD, AT_STATX_DONT_SYNC, Statx, find_date_dir, scan_subdirs,
+    statx_mtime)
+
+_scandir = os.scandir
+
+
+def unreadable(*paths: str):
+    """Make os.scandir fail on the given paths, as for a chmod 000 directory.
+
+    Permissions are not enforced for root, hence they are not relied upon.
+    """
+    def scandir(path="."):
+        if os.fspath(path) in paths:
+            raise PermissionError(13, "Permission denied", os.fspath(path))
+        return _scandir(path)
+
+    return mock.patch("os.scandir", scandir)
+
+
+class TreeTestCase(unittest.TestCase):
+    """Build a temporary tree of directories with given modification times."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name).resolve()
+
+    def make(self, tree: dict, mtime: float = 0.0):
+        """Create the tree, a dict mapping relative paths to timestamps.
+
+        Children are touched before their parents, so that the creation of a
+        child does not change the time of its parent.
+        """
+        for rel in sorted(tree, key=lambda r: -r.count("/")):
+            (self.root / rel).mkdir(parents=True, exist_ok=True)
+        for rel in sorted(tree, key=lambda r: -r.count("/")):
+            os.utime(self.root / rel, (tree[rel], tree[rel]))
+        os.utime(self.root, (mtime, mtime))
+
+
+@unittest.skipIf(importer.inputdir.STATX is None, "statx is not available")
+class TestStatx(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        self.addCleanup(os.remove, tmp.name)
+        with tmp:
+            tmp.write(b"x" * 1234)
+        os.chmod(tmp.name, 0o640)
+        os.utime(tmp.name, ns=(0, 1_600_000_000_123_456_789))
+        self.path = tmp.name
+
+    def test_struct(self):
+        # all the basic fields, to check the layout of the structure
+        buf = Statx()
+        ret = importer.inputdir.STATX(
+            AT_FDCWD, os.fsencode(self.path), AT_STATX_DONT_SYNC, 0x7ff,
+            ctypes.byref(buf))
+        if ret != 0 and ctypes.get_errno() == errno.ENOSYS:
+            self.skipTest("statx is not supported by the kernel")
+        self.assertEqual(ret, 0)
+        st = os.stat(self.path)
+        self.assertEqual(buf.stx_size, st.st_size)
+        self.assertEqual(buf.stx_mode, st.st_mode)
+        self.assertEqual(buf.stx_ino, st.st_ino)
+        self.assertEqual(buf.stx_mtime.tv_sec * 10**9 + buf.stx_mtime.tv_nsec,
+                         st.st_mtime_ns)
+
+    def test_mtime(self):
+        st = os.stat(self.path)
+        self.assertAlmostEqual(statx_mtime(self.path), st.st_mtime, places=6)
+        with os.scandir(os.path.dirname(self.path)) as it:
+            entry = next(e for e in it if e.path == self.path)
+        self.assertAlmostEqual(statx_mtime(entry), st.st_mtime, places=6)
+
+    def test_fallback(self):
+        with mock.patch.object(importer.inputdir, "STATX", None):
+            self.assertEqual(statx_mtime(self.path),
+                             os.stat(self.path).st_mtime)
+
+
+class TestScanSubdirs(TreeTestCase):
+
+    def test_unreadable(self):
+        self.make({"a": 100.0, "a/b": 50.0})
+        bad = str(self.root / "a")
+        with unreadable(bad):
+            self.assertEqual(scan_subdirs(bad, 0.0), [])
+            subdirs = scan_subdirs(str(self.root), 0.0)
+        self.assertEqual(subdirs, [(bad, 100.0, False)])
+
+
+class TestFindDateDir(TreeTestCase):
+
+    def test_unreadable_subdir(self):
+        self.make({
+            "a": 1400.0, "a/x": 1390.0,
+            "b": 1550.0, "b/y": 1500.0,
+        }, mtime=3000.0)
+        date = datetime.fromtimestamp(1500.0)
+        for threads in (1, 4):
+            with self.subTest(threads=threads), \
+                    unreadable(str(self.root / "b")):
+                found = find_date_dir(date, self.root, n=2, threads=threads)
+                self.assertEqual(found, [self.root / "b", self.root / "a"])
+
+    def test_threads_deterministic(self):
+        # a tree that is not chronological, so that the pruning depends on
+        # the order in which directories are merged
+        rng = random.Random(0)
+        tree = {}
+        for i in range(5):
+            for j in range(rng.randint(1, 5)):
+                for k in range(rng.randint(0, 5)):
+                    tree[f"d{i}/d{j}/d{k}"] = rng.uniform(0, 1e6)
+                tree[f"d{i}/d{j}"] = rng.uniform(0, 1e6)
+            tree[f"d{i}"] = rng.uniform(0, 1e6)
+        self.make(tree)
+        date = datetime.fromtimestamp(5e5)
+        expected = find_date_dir(date, self.root, n=5)
+        for threads in (2, 4, 8):
+            for _ in range(3):
+                with self.subTest(threads=threads):
+                    self.assertEqual(find_date_dir(
+                        date, self.root, n=5, threads=threads), expected)
+
+    def test_early_termination(self):
+        # the descendants of old cannot score better than old, hence than the x
+        self.make({
+            "new1": 1500.0, "new1/x1": 1.0, "new1/x2": 2.0, "new1/x3": 3.0,
+            "new2": 1600.0, "new3": 1700.0,
+            "old": -1000.0, "old/deep": -1100.0,
+        }, mtime=2000.0)
+        old = str(self.root / "old")
+        for threads in (1, 2):
+            scanned = []
+
+            def scan(dir, *args):
+                scanned.append(dir)
+                return scan_subdirs(dir, *args)
+
+            with self.subTest(threads=threads), \
+                    mock.patch.object(importer.inputdir, "scan_subdirs", scan):
+                found = find_date_dir(
+                    datetime.fromtimestamp(0.0), self.root, n=3,
+                    threads=threads)
+                self.assertEqual(found, [self.root / "new1" / f"x{i}"
+                                         for i in (1, 2, 3)])
+                self.assertNotIn(old, scanned)
+
+    def test_hidden_leaf(self):
+        # p is older than the date, yet it holds an exact match: the tree is
+        # not chronological, and the search is a heuristic for such trees
+        self.make({
+            "p": -5000.0, "p/leaf": 0.0,
+            "q": 100.0, "q/x": 10.0, "q/y": 20.0, "q/z": 30.0,
+            "r": 200.0,
+        }, mtime=10000.0)
+        date = datetime.fromtimestamp(0.0)
+        q = self.root / "q"
+        # once the x, y and z are found, nothing under p is expected to
+        # improve on them, so p is not scanned and the leaf is missed
+        self.assertEqual(find_date_dir(date, self.root, n=3),
+                         [q / "x", q / "y", q / "z"])
+        # the slack loosens the bound of p enough to find it
+        self.assertEqual(find_date_dir(date, self.root, n=3, slack=5000.0),
+                         [self.root / "p" / "leaf", q / "x", q / "y"])
+        # but p is not descended into if it is not among the n best
+        self.assertEqual(find_date_dir(date, self.root, n=2, slack=5000.0),
+                         [q / "x", q / "y"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Tests for importer.main."""
+
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+from importer.main import parse_date, paths_good
+
+
+class TestParseDate(unittest.TestCase):
+
+    def test_dates(self):
+        cases = {
+            "2024-05-10": datetime(2024, 5, 10, 13),
+            "2024-5-10": datetime(2024, 5, 10, 13),
+            "2024-05-1": datetime(2024, 5, 1, 13),
+        }
+        for datestr, expected in cases.items():
+            with self.subTest(datestr=datestr):
+                self.assertEqual(parse_date(datestr), expected)
+
+    def test_rejected(self):
+        # ISO 8601 forms accepted by date.fromisoformat, and invalid dates
+        for datestr in ("20240510", "2024-W19-5", "2024-130", "2024-02-30",
+                        "2024-05-10T10:00", "10-05-2024", ""):
+            with self.subTest(datestr=datestr):
+                with self.assertRaises(ValueError):
+                    parse_date(datestr)
+
+
+class TestPathsGood(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def test_good(self):
+        self.assertTrue(paths_good(self.dir, self.dir, self.dir))
+
+    def test_all_reported(self):
+        out = self.dir / "out"
+        repo = self.dir / "repo"
+        with self.assertLogs("importer", "ERROR") as cm:
+            self.assertFalse(paths_good(self.dir, out, repo))
+        self.assertEqual(cm.output, [
+            f"ERROR:importer:Specified output path {out} is not a directory.",
+            f"ERROR:importer:Specified repository path {repo} is not a "
+            "directory.",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Tests for importer.remote."""
+
+import unittest
+from ipaddress import ip_address
+from pathlib import Path
+from subprocess import CompletedProcess
+from unittest import mock
+
+import importer.remote
+from importer.remote import LOCALHOST, RemoteRepo, parse_ping_res, ping
+
+IPUTILS = b"""\
+PING 10.0.0.1 (10.0.0.1) 56(84) bytes of data.
+64 bytes from 10.0.0.1: icmp_seq=1 ttl=64 time=0.398 ms
+64 bytes from 10.0.0.1: icmp_seq=3 ttl=64 time=0.412 ms
+
+--- 10.0.0.1 ping statistics ---
+3 packets transmitted, 2 received, 33.3333% packet loss, time 2003ms
+rtt min/avg/max/mdev = 0.398/0.405/0.412/0.007 ms
+"""
+
+BUSYBOX = b"""\
+PING 10.0.0.1 (10.0.0.1): 56 data bytes
+64 bytes from 10.0.0.1: seq=0 ttl=64 time=0.052 ms
+64 bytes from 10.0.0.1: seq=1 ttl=64 time=0.081 ms
+64 bytes from 10.0.0.1: seq=2 ttl=64 time=0.068 ms
+
+--- 10.0.0.1 ping statistics ---
+3 packets transmitted, 3 packets received, 0% packet loss
+round-trip min/avg/max = 0.052/0.067/0.081 ms
+"""
+
+# all the packets lost: no round-trip summary
+LOST = b"""\
+PING 10.0.0.1 (10.0.0.1) 56(84) bytes of data.
+
+--- 10.0.0.1 ping statistics ---
+3 packets transmitted, 0 received, 100% packet loss, time 2031ms
+"""
+
+
+def completed(stdout: bytes, returncode: int = 0) -> CompletedProcess:
+    return CompletedProcess(["ping"], returncode, stdout, b"")
+
+
+class TestParsePingRes(unittest.TestCase):
+
+    def test_iputils(self):
+        self.assertEqual(
+            parse_ping_res(completed(IPUTILS)),
+            "Server check for 10.0.0.1:\n"
+            "\t2/3 packets received.\n"
+            "\tPing (ms): min 0.398, max 0.412"
+        )
+
+    def test_busybox(self):
+        self.assertEqual(
+            parse_ping_res(completed(BUSYBOX)),
+            "Server check for 10.0.0.1:\n"
+            "\t3/3 packets received.\n"
+            "\tPing (ms): min 0.052, max 0.081"
+        )
+
+    def test_unrecognized(self):
+        for stdout in (LOST, b"", b"ping: unknown host\n"):
+            with self.subTest(stdout=stdout):
+                with self.assertRaises(ValueError):
+                    parse_ping_res(completed(stdout))
+
+    def test_ping_unrecognized(self):
+        # the server answered, only the summary is missing: not a failure
+        with mock.patch.object(importer.remote, "run_cmd",
+                               return_value=completed(b"")), \
+                self.assertLogs("importer.remote", "WARNING"):
+            self.assertEqual(ping(ip_address("10.0.0.1")), (True, ""))
+
+
+class TestRemoteRepo(unittest.TestCase):
+
+    def setUp(self):
+        self.ping = mock.Mock(return_value=(True, "pong"))
+        self.mount = mock.Mock(return_value=(True, "mounted"))
+        for patch in (
+            mock.patch.object(importer.remote, "ping", self.ping),
+            mock.patch.object(importer.remote, "mount_remote", self.mount),
+            mock.patch.object(importer.remote, "unmount_remote",
+                              return_value=(True, "unmounted")),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def enter(self, server_ip, server_ck):
+        with RemoteRepo(Path("mnt"), server_ip, server_ck) as mnt:
+            return mnt
+
+    def test_server_check(self):
+        remote = ip_address("10.0.0.1")
+        cases = [
+            # by default, localhost is not checked
+            (LOCALHOST, None, False),
+            (remote, None, True),
+            (LOCALHOST, True, True),
+            (remote, True, True),
+            (LOCALHOST, False, False),
+            (remote, False, False),
+        ]
+        for server_ip, server_ck, pinged in cases:
+            self.ping.reset_mock()
+            with self.subTest(server_ip=server_ip, server_ck=server_ck):
+                mnt = self.enter(server_ip, server_ck)
+                self.assertEqual(mnt, Path("mnt").absolute())
+                if pinged:
+                    self.ping.assert_called_once_with(server_ip)
+                else:
+                    self.ping.assert_not_called()
+
+    def test_server_down(self):
+        self.ping.return_value = (False, "down")
+        with self.assertLogs("importer.remote", "ERROR"):
+            mnt = self.enter(ip_address("10.0.0.1"), None)
+        self.assertIsInstance(mnt, Exception)
+        self.mount.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()